@@ -1,11 +1,18 @@
 from __future__ import annotations
 
 import argparse
-import json
+import logging
+import math
 import os
-from typing import Any, Dict, List, Optional
+import random
+import threading
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import quote
 
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
 
 try:
     from dotenv import load_dotenv
@@ -14,11 +21,124 @@ except Exception:
     pass
 
 
+logger = logging.getLogger(__name__)
+
+_SESSION = requests.Session()
+_ADAPTER = HTTPAdapter(pool_connections=4, pool_maxsize=20, max_retries=0)
+_SESSION.mount("http://", _ADAPTER)
+_SESSION.mount("https://", _ADAPTER)
+_SESSION.headers.update({"Connection": "keep-alive"})
+
+_RETRIABLE_STATUS = frozenset({429, 500, 502, 503, 504})
+_CONNECT_TIMEOUT_SEC = 1.0
+_READ_TIMEOUT_SEC = 10.0
+_MAX_ATTEMPTS = 3
+_BACKOFF_BASE_SEC = 0.2
+
+
+class _TransientHTTPError(requests.exceptions.HTTPError):
+    pass
+
+
+class CircuitOpenError(RuntimeError):
+    pass
+
+
+# Opens after `threshold` consecutive transport failures for a base URL and
+# lets a trial request through again once `cooldown_sec` has elapsed.
+class _CircuitBreaker:
+    def __init__(self, threshold: int = 3, cooldown_sec: float = 30.0):
+        self.threshold = threshold
+        self.cooldown_sec = cooldown_sec
+        self.fails = 0
+        self.opened_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            return self.opened_at is None or time.monotonic() - self.opened_at >= self.cooldown_sec
+
+    def record(self, ok: bool) -> None:
+        with self._lock:
+            if ok:
+                self.fails = 0
+                self.opened_at = None
+            else:
+                self.fails += 1
+                if self.fails >= self.threshold:
+                    self.opened_at = time.monotonic()
+
+
+_BREAKERS: Dict[str, _CircuitBreaker] = {}
+_BREAKERS_LOCK = threading.Lock()
+
+
+def _breaker_for(base: str) -> _CircuitBreaker:
+    with _BREAKERS_LOCK:
+        breaker = _BREAKERS.get(base)
+        if breaker is None:
+            breaker = _BREAKERS[base] = _CircuitBreaker()
+        return breaker
+
+
+def _request_with_retries(
+    method: str, url: str, attempts: int = _MAX_ATTEMPTS, **kwargs: Any
+) -> requests.Response:
+    # Retry connection errors (including connect timeouts) and 429/5xx with
+    # full-jitter exponential backoff. Read timeouts are retried only for
+    # GET: a POSTed tool may still be running on the server. Any other
+    # response is returned as-is.
+    retriable: Tuple[type, ...] = (requests.exceptions.ConnectionError, _TransientHTTPError)
+    if method == "GET":
+        retriable += (requests.exceptions.Timeout,)
+    for attempt in range(attempts):
+        try:
+            r = _SESSION.request(method, url, **kwargs)
+            if r.status_code in _RETRIABLE_STATUS:
+                raise _TransientHTTPError(f"{r.status_code} Error for url: {url}", response=r)
+            return r
+        except retriable:
+            if attempt == attempts - 1:
+                raise
+            time.sleep(random.uniform(0, _BACKOFF_BASE_SEC * (2**attempt)))
+    raise AssertionError("unreachable")
+
+
+def _send(method: str, base: str, path: str, attempts: int = _MAX_ATTEMPTS, **kwargs: Any) -> requests.Response:
+    breaker = _breaker_for(base)
+    if not breaker.allow():
+        raise CircuitOpenError(f"MCP server at {base} is failing; circuit open, skipping {path}")
+    try:
+        r = _request_with_retries(method, f"{base}{path}", attempts, **kwargs)
+    except (requests.exceptions.ConnectionError, requests.exceptions.Timeout, _TransientHTTPError):
+        breaker.record(False)
+        raise
+    # A non-retriable response (including tool 4xx errors) means the server is up.
+    breaker.record(True)
+    r.raise_for_status()
+    return r
+
+
+def _tool_timeout(calls: Iterable[Dict[str, Any]]) -> Tuple[float, float]:
+    # get_cpu_usage holds the response for its whole sampling window, so the
+    # read timeout has to cover that on top of the usual budget.
+    extra = 0.0
+    for c in calls:
+        if c.get("name") != "get_cpu_usage":
+            continue
+        try:
+            window = float((c.get("args") or {}).get("interval_sec", 0.5))
+        except (TypeError, ValueError):
+            continue
+        if math.isfinite(window) and window > 0:
+            extra += window
+    return (_CONNECT_TIMEOUT_SEC, _READ_TIMEOUT_SEC + extra)
+
+
 def list_tools(base: str) -> List[str]:
     try:
-        r = requests.get(f"{base}/tools/list", timeout=5)
-        r.raise_for_status()
-        return [t["name"] for t in r.json()]
+        r = _send("GET", base, "/tools/list", timeout=(_CONNECT_TIMEOUT_SEC, 5.0))
+        return [t["name"] for t in orjson.loads(r.content)]
     except requests.exceptions.RequestException as e:
         raise RuntimeError(
             f"Could not reach MCP server at {base}. Is it running? Original error: {e}"
@@ -27,176 +147,289 @@ def list_tools(base: str) -> List[str]:
 
 def call(base: str, name: str, args: Dict[str, Any] | None = None) -> Any:
     try:
-        r = requests.post(
-            f"{base}/tools/call", json={"name": name, "args": args or {}}, timeout=10
+        r = _send(
+            "POST",
+            base,
+            "/tools/call",
+            data=orjson.dumps({"name": name, "args": args or {}}),
+            headers={"Content-Type": "application/json"},
+            timeout=_tool_timeout([{"name": name, "args": args}]),
         )
-        r.raise_for_status()
-        return r.json()["result"]
+        return orjson.loads(r.content)["result"]
     except requests.exceptions.RequestException as e:
         raise RuntimeError(
             f"Failed calling tool '{name}' at {base}. Check server logs. Original error: {e}"
         )
 
 
-def generate_health_report(base: str, top_n: int = 5, cpu_window: float = 0.5) -> str:
-    sysinfo = call(base, "get_system_info")
-    cpu = call(base, "get_cpu_usage", {"interval_sec": cpu_window})
-    procs = call(base, "list_processes", {"limit": top_n})
-
-    lines = []
-    lines.append("System Health Report")
-    lines.append("====================")
-    lines.append("")
-    lines.append("System Info:")
-    for k in [
-        "platform",
-        "release",
-        "version",
-        "arch",
-        "hostname",
-        "uptime_sec",
-        "total_mem_bytes",
-        "free_mem_bytes",
-        "cpu_count",
-        "cpu_model",
-    ]:
-        lines.append(f"- {k}: {sysinfo.get(k)}")
-
-    lines.append("")
-    lines.append(f"CPU Usage: {cpu['cpu_usage_percent']}% (window {cpu['window_sec']}s)")
-
-    lines.append("")
-    lines.append("Top Processes (by CPU):")
+def call_many(base: str, calls: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    # Each entry of the response is either {"result": ...} or {"error": ...}.
+    try:
+        r = _send(
+            "POST",
+            base,
+            "/tools/batch",
+            data=orjson.dumps(calls),
+            headers={"Content-Type": "application/json"},
+            timeout=_tool_timeout(calls),
+        )
+        return orjson.loads(r.content)
+    except requests.exceptions.RequestException as e:
+        raise RuntimeError(
+            f"Failed calling tool batch at {base}. Check server logs. Original error: {e}"
+        )
+
+
+_HEADER = "System Health Report\n====================\n"
+_SYS_KEYS = (
+    "platform",
+    "release",
+    "version",
+    "arch",
+    "hostname",
+    "uptime_sec",
+    "total_mem_bytes",
+    "free_mem_bytes",
+    "cpu_count",
+    "cpu_model",
+)
+
+
+def _iter_health_report(
+    sysinfo: Dict[str, Any], cpu: Dict[str, Any], procs: List[Dict[str, Any]]
+) -> Iterator[str]:
+    yield _HEADER + "\n"
+    yield "System Info:\n"
+    for k in _SYS_KEYS:
+        yield f"- {k}: {sysinfo.get(k)}\n"
+    yield "\n"
+    yield f"CPU Usage: {cpu['cpu_usage_percent']}% (window {cpu['window_sec']}s)\n"
+    yield "\n"
+    yield "Top Processes (by CPU):\n"
     for p in procs:
-        lines.append(f"- pid={p['pid']} cpu={p['cpu']}% mem={p['mem']}% cmd={p['cmd']}")
+        yield f"- pid={p['pid']} cpu={p['cpu']}% mem={p['mem']}% cmd={p['cmd']}\n"
 
-    return "\n".join(lines) + "\n"
 
+def _format_health_report(sysinfo: Dict[str, Any], cpu: Dict[str, Any], procs: List[Dict[str, Any]]) -> str:
+    return "".join(_iter_health_report(sysinfo, cpu, procs))
 
-def try_gemini_agent(base: str, goal: str, out_file: Optional[str]) -> Optional[str]:
-    api_key = os.getenv("GOOGLE_API_KEY")
-    if not api_key:
-        return None
-    try:
-        import google.generativeai as genai
 
-        print("startinggggg Agenttttttttttttttt")
-        genai.configure(api_key=api_key)
+def _collect_health_data(
+    base: str, top_n: int, cpu_window: float
+) -> Tuple[Dict[str, Any], Dict[str, Any], List[Dict[str, Any]]]:
+    # One round-trip for all three tools; the server runs them concurrently
+    # so the CPU sampling window overlaps with the other two.
+    calls = [
+        {"name": "get_system_info"},
+        {"name": "get_cpu_usage", "args": {"interval_sec": cpu_window}},
+        {"name": "list_processes", "args": {"limit": top_n}},
+    ]
+    results = call_many(base, calls)
+    if not isinstance(results, list) or len(results) != len(calls):
+        raise RuntimeError(f"Unexpected reply from tool batch at {base}: expected {len(calls)} results")
+    for c, res in zip(calls, results):
+        if "error" in res:
+            raise RuntimeError(f"Tool '{c['name']}' failed at {base}: {res['error']}")
+    sysinfo, cpu, procs = (res["result"] for res in results)
+    return sysinfo, cpu, procs
 
-        function_declarations = [
-            {
-                "name": "get_system_info",
-                "description": "Get OS, memory, CPU and uptime info",
-                "parameters": {"type": "object", "properties": {}},
-            },
-            {
-                "name": "get_cpu_usage",
-                "description": "Measure CPU usage over a small window",
-                "parameters": {
-                    "type": "object",
-                    "properties": {"interval_sec": {"type": "number", "description": "Time window in seconds (default: 0.5)"}},
-                },
-            },
-            {
-                "name": "list_processes",
-                "description": "List top processes by CPU",
-                "parameters": {
-                    "type": "object",
-                    "properties": {"limit": {"type": "integer", "description": "Number of top processes (default: 5)"}},
-                },
-            },
-            {
-                "name": "store_in_file",
-                "description": "Save content to a file on the MCP server output directory",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "file_name": {"type": "string", "description": "Name of the file to create"},
-                        "content": {"type": "string", "description": "Content to write to the file"},
-                    },
-                    "required": ["file_name", "content"],
-                },
-            },
-        ]
-
-        model = genai.GenerativeModel(
-            model_name="gemini-2.5-flash",
-            tools={"function_declarations": function_declarations},
-            system_instruction=(
-                "You are an autonomous agent with tools. "
-                "When asked to generate a health report, call get_system_info, get_cpu_usage, and list_processes to gather data, "
-                "then format the data into a comprehensive report and save it using store_in_file. "
-                "Always save the report to a file when requested."
-            ),
+
+def generate_health_report(base: str, top_n: int = 5, cpu_window: float = 0.5) -> str:
+    return _format_health_report(*_collect_health_data(base, top_n, cpu_window))
+
+
+_STREAM_CHUNK_BYTES = 64 * 1024
+
+
+def _encode_chunks(parts: Iterable[str], size: int = _STREAM_CHUNK_BYTES) -> Iterator[bytes]:
+    # Coalesce small string parts (e.g. report lines) into ~size-byte chunks
+    # so each HTTP chunk and server-side write carries a useful amount of data.
+    buf: List[bytes] = []
+    buffered = 0
+    for part in parts:
+        data = part.encode("utf-8")
+        buf.append(data)
+        buffered += len(data)
+        if buffered >= size:
+            yield b"".join(buf)
+            buf.clear()
+            buffered = 0
+    if buf:
+        yield b"".join(buf)
+
+
+def store_stream(base: str, file_name: str, chunks: Iterable[str]) -> Dict[str, Any]:
+    # The body is a one-shot generator, so this request is never retried.
+    try:
+        r = _send(
+            "POST",
+            base,
+            f"/tools/store_stream/{quote(file_name, safe='')}",
+            attempts=1,
+            data=_encode_chunks(chunks),
+            headers={"Content-Type": "application/octet-stream"},
+            timeout=(_CONNECT_TIMEOUT_SEC, _READ_TIMEOUT_SEC),
+        )
+        return orjson.loads(r.content)
+    except requests.exceptions.RequestException as e:
+        raise RuntimeError(
+            f"Failed streaming '{file_name}' to {base}. Check server logs. Original error: {e}"
         )
 
-        chat = model.start_chat()
-        print(f"Sendinggggggggggg goal: {goal}")
-        resp = chat.send_message(goal)
-
-        accumulated: Dict[str, Any] = {}
-        loops = 0
-        while loops < 3 and hasattr(resp, "candidates"):
-            loops += 1
-            made_tool_call = False
-            for cand in resp.candidates or []:
-                for part in getattr(cand.content, "parts", []) or []:
-                    fc = getattr(part, "function_call", None)
-                    if not fc:
-                        continue
-                    name = fc.name
-                    if isinstance(fc.args, str):
-                        args = json.loads(fc.args)
-                    elif hasattr(fc.args, 'items'):
-                        args = dict(fc.args)
-                    else:
-                        args = {}
-                    print(f"[Gemini Agent] Calling tool: {name}")
-                    print(f"[Gemini Agent] Arguments: {json.dumps(args, indent=2)}")
-                    result = call(base, name, args)
-                    print(f"[Gemini Agent] Result: {json.dumps(result, indent=2)}")
-                    accumulated[name] = result
-                    made_tool_call = True
-                    try:
-                        from google.ai.generativelanguage import Content, Part, FunctionResponse
 
-                        response_part = Part(
-                            function_response=FunctionResponse(
-                                name=name,
-                                response={"result": result}
-                            )
+def store_health_report(base: str, file_name: str, top_n: int = 5, cpu_window: float = 0.5) -> str:
+    data = _collect_health_data(base, top_n, cpu_window)
+    return store_stream(base, file_name, _iter_health_report(*data))["path"]
+
+
+_FUNCTION_DECLARATIONS: List[Dict[str, Any]] = [
+    {
+        "name": "get_system_info",
+        "description": "Get OS, memory, CPU and uptime info",
+        "parameters": {"type": "object", "properties": {}},
+    },
+    {
+        "name": "get_cpu_usage",
+        "description": "Measure CPU usage over a small window",
+        "parameters": {
+            "type": "object",
+            "properties": {"interval_sec": {"type": "number", "description": "Time window in seconds (default: 0.5)"}},
+        },
+    },
+    {
+        "name": "list_processes",
+        "description": "List top processes by CPU",
+        "parameters": {
+            "type": "object",
+            "properties": {"limit": {"type": "integer", "description": "Number of top processes (default: 5)"}},
+        },
+    },
+    {
+        "name": "store_in_file",
+        "description": "Save content to a file on the MCP server output directory",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "file_name": {"type": "string", "description": "Name of the file to create"},
+                "content": {"type": "string", "description": "Content to write to the file"},
+            },
+            "required": ["file_name", "content"],
+        },
+    },
+]
+
+_SYSTEM_INSTRUCTION = (
+    "You are an autonomous agent with tools. "
+    "When asked to generate a health report, call get_system_info, get_cpu_usage, and list_processes to gather data, "
+    "then format the data into a comprehensive report and save it using store_in_file. "
+    "Always save the report to a file when requested."
+)
+
+_MODEL = None
+_MODEL_LOCK = threading.Lock()
+
+
+def _get_model(api_key: str):
+    global _MODEL
+    if _MODEL is None:
+        with _MODEL_LOCK:
+            if _MODEL is None:
+                import google.generativeai as genai
+
+                genai.configure(api_key=api_key)
+                _MODEL = genai.GenerativeModel(
+                    model_name="gemini-2.5-flash",
+                    tools={"function_declarations": _FUNCTION_DECLARATIONS},
+                    system_instruction=_SYSTEM_INSTRUCTION,
+                )
+    return _MODEL
+
+
+def _run_gemini_agent(chat, base: str, goal: str, out_file: Optional[str]) -> str:
+    logger.debug("[Gemini Agent] Sending goal: %s", goal)
+    resp = chat.send_message(goal)
+
+    accumulated: Dict[str, Any] = {}
+    loops = 0
+    while loops < 3 and hasattr(resp, "candidates"):
+        loops += 1
+        made_tool_call = False
+        for cand in resp.candidates or []:
+            for part in getattr(cand.content, "parts", []) or []:
+                fc = getattr(part, "function_call", None)
+                if not fc:
+                    continue
+                name = fc.name
+                if isinstance(fc.args, (str, bytes)):
+                    args = orjson.loads(fc.args)
+                elif hasattr(fc.args, 'items'):
+                    args = dict(fc.args)
+                else:
+                    args = {}
+                logger.info("[Gemini Agent] Calling tool: %s", name)
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug(
+                        "[Gemini Agent] Arguments: %s",
+                        orjson.dumps(args, default=str, option=orjson.OPT_INDENT_2).decode(),
+                    )
+                result = call(base, name, args)
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("[Gemini Agent] Result: %s", orjson.dumps(result, option=orjson.OPT_INDENT_2).decode())
+                accumulated[name] = result
+                made_tool_call = True
+                try:
+                    from google.ai.generativelanguage import Content, Part, FunctionResponse
+
+                    response_part = Part(
+                        function_response=FunctionResponse(
+                            name=name,
+                            response={"result": result}
+                        )
+                    )
+                    resp = chat.send_message(Content(parts=[response_part]))
+                except Exception as send_err:
+                    logger.warning("[Gemini Agent] Error sending response: %s", send_err)
+                    try:
+                        resp = chat.send_message(
+                            f"Tool {name} returned: {orjson.dumps(result).decode()}"
                         )
-                        resp = chat.send_message(Content(parts=[response_part]))
-                    except Exception as send_err:
-                        print(f"[Gemini Agent] Error sending response: {send_err}")
-                        try:
-                            resp = chat.send_message(
-                                f"Tool {name} returned: {json.dumps(result)}"
-                            )
-                        except:
-                            raise send_err
-            if not made_tool_call:
-                break
-
-        if out_file and "store_in_file" not in accumulated:
-            content = None
-            if "get_system_info" in accumulated and "get_cpu_usage" in accumulated and "list_processes" in accumulated:
-                print("[Gemini Agent] Generating health report from collected data...")
-                content = generate_health_report(base)
-            if not content and hasattr(resp, "text") and resp.text:
-                content = resp.text
-            if content:
-                print(f"[Gemini Agent] Saving to file: {out_file}")
-                stored = call(base, "store_in_file", {"file_name": out_file, "content": content})
-                return stored.get("path")
-
-        if hasattr(resp, "text") and resp.text:
-            print(f"[Gemini Agent] Final response: {resp.text}")
-            return resp.text
-        print(f"[Gemini Agent] Accumulated results: {json.dumps(accumulated, indent=2)}")
-        return json.dumps(accumulated)
+                    except:
+                        raise send_err
+        if not made_tool_call:
+            break
+
+    if out_file and "store_in_file" not in accumulated:
+        if "get_system_info" in accumulated and "get_cpu_usage" in accumulated and "list_processes" in accumulated:
+            logger.info("[Gemini Agent] Generating health report from collected data...")
+            logger.info("[Gemini Agent] Saving to file: %s", out_file)
+            return store_health_report(base, out_file)
+        content = resp.text if hasattr(resp, "text") and resp.text else None
+        if content:
+            logger.info("[Gemini Agent] Saving to file: %s", out_file)
+            stored = call(base, "store_in_file", {"file_name": out_file, "content": content})
+            return stored.get("path")
+
+    if hasattr(resp, "text") and resp.text:
+        logger.debug("[Gemini Agent] Final response: %s", resp.text)
+        return resp.text
+    return orjson.dumps(accumulated).decode()
+
+
+def try_gemini_agent(base: str, goal: str, out_file: Optional[str]) -> Optional[str]:
+    api_key = os.getenv("GOOGLE_API_KEY")
+    if not api_key:
+        return None
+    if not _breaker_for(base).allow():
+        logger.warning("[Gemini Agent] Skipping, MCP server at %s is unavailable (circuit open)", base)
+        return None
+    try:
+        chat = _get_model(api_key).start_chat()
+        return _run_gemini_agent(chat, base, goal, out_file)
+    except CircuitOpenError as e:
+        logger.warning("[Gemini Agent] Skipping, MCP server unavailable: %s", e)
+        return None
     except Exception as e:
-        print(f"[Gemini Agent] Error: {e}")
+        logger.error("[Gemini Agent] Error: %s", e)
         return None
 
 
@@ -205,20 +438,18 @@ def deterministic_agent(base: str, goal: str, out_file: Optional[str]) -> str:
     tools = set(list_tools(base))
 
     if "health" in g and ("report" in g or "summary" in g):
-        report = generate_health_report(base)
         if out_file and "store_in_file" in tools:
-            saved = call(base, "store_in_file", {"file_name": out_file, "content": report})
-            return saved["path"]
-        return report
+            return store_health_report(base, out_file)
+        return generate_health_report(base)
 
     if "cpu" in g and "usage" in g:
         cpu = call(base, "get_cpu_usage", {"interval_sec": 0.5})
-        return json.dumps(cpu, indent=2)
+        return orjson.dumps(cpu, option=orjson.OPT_INDENT_2).decode()
     if "process" in g:
         procs = call(base, "list_processes", {"limit": 5})
-        return json.dumps(procs, indent=2)
+        return orjson.dumps(procs, option=orjson.OPT_INDENT_2).decode()
 
-    return json.dumps({"available_tools": sorted(tools)}, indent=2)
+    return orjson.dumps({"available_tools": sorted(tools)}, option=orjson.OPT_INDENT_2).decode()
 
 
 def main():
@@ -231,10 +462,15 @@ def main():
     parser.add_argument("--goal", default="Create a system health report and save it to a file.", help="High-level goal for the agent")
     parser.add_argument("--out", default="health_report.txt", help="Output file name (when applicable)")
     args = parser.parse_args()
+    level_name = os.getenv("LOG_LEVEL", "INFO").upper()
+    level = logging.getLevelName(level_name)
+    logging.basicConfig(level=level if isinstance(level, int) else logging.INFO, format="%(message)s")
+    if not isinstance(level, int):
+        logger.warning("Unknown LOG_LEVEL %r, using INFO", level_name)
 
     result = try_gemini_agent(args.base, args.goal, args.out)
     if result is None:
-        print("Gemini not availableeeeeeeeeeeee...")
+        logger.info("Gemini agent not available, falling back to deterministic agent")
         result = deterministic_agent(args.base, args.goal, args.out)
     print("\n=== Final Result ===")
     print(result)
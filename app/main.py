@@ -1,13 +1,26 @@
 from __future__ import annotations
 
+import asyncio
+import heapq
+import inspect
+import logging
+import math
+import os
 import platform
 import socket
+import sys
+import tempfile
+import threading
 import time
+from array import array
 from pathlib import Path
-from typing import Any, Dict, List
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
+import orjson
 import psutil
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel, Field
 
 
@@ -20,84 +33,361 @@ class ToolListItem(BaseModel):
     name: str
 
 
-app = FastAPI(title="MCP System Info & Utility Server", version="1.0.0")
+logger = logging.getLogger(__name__)
+
+
+app = FastAPI(
+    title="MCP System Info & Utility Server",
+    version="1.0.0",
+    default_response_class=ORJSONResponse,
+)
+
+
+_STATIC_SYSINFO: Dict[str, Any] = {
+    "platform": platform.system(),
+    "release": platform.release(),
+    "version": platform.version(),
+    "arch": platform.machine(),
+    "hostname": socket.gethostname(),
+    "cpu_count": psutil.cpu_count(logical=True) or 0,
+    "cpu_model": platform.processor() or "unknown",
+}
+_BOOT_TIME = psutil.boot_time()
 
 
 def get_system_info() -> Dict[str, Any]:
+    vm = psutil.virtual_memory()
     return {
-        "platform": platform.system(),
-        "release": platform.release(),
-        "version": platform.version(),
-        "arch": platform.machine(),
-        "hostname": socket.gethostname(),
-        "uptime_sec": int(time.time() - psutil.boot_time()),
-        "total_mem_bytes": psutil.virtual_memory().total,
-        "free_mem_bytes": psutil.virtual_memory().available,
-        "cpu_count": psutil.cpu_count(logical=True) or 0,
-        "cpu_model": platform.processor() or "unknown",
+        **_STATIC_SYSINFO,
+        "uptime_sec": int(time.time() - _BOOT_TIME),
+        "total_mem_bytes": vm.total,
+        "free_mem_bytes": vm.available,
     }
 
 
-def get_cpu_usage(interval_sec: float = 0.5) -> Dict[str, Any]:
-    value = psutil.cpu_percent(interval=interval_sec)
-    return {"cpu_usage_percent": round(float(value), 2), "window_sec": interval_sec}
+def _cpu_busy_percent(t1: Any, t2: Any) -> float:
+    # Same accounting as psutil.cpu_percent, but from two explicit snapshots
+    # so concurrent measurements don't share psutil's per-thread baseline.
+    # guest/guest_nice are already counted in user/nice on Linux.
+    def totals(t: Any) -> Tuple[float, float]:
+        total = sum(t) - getattr(t, "guest", 0.0) - getattr(t, "guest_nice", 0.0)
+        return total, total - t.idle - getattr(t, "iowait", 0.0)
 
+    all1, busy1 = totals(t1)
+    all2, busy2 = totals(t2)
+    all_delta = all2 - all1
+    if all_delta <= 0:
+        return 0.0
+    return min(100.0, max(0.0, (busy2 - busy1) / all_delta * 100))
 
-def list_processes(limit: int = 5) -> List[Dict[str, Any]]:
-    procs = []
+
+async def get_cpu_usage(interval_sec: float = 0.5) -> Dict[str, Any]:
+    if not math.isfinite(interval_sec) or interval_sec < 0:
+        raise ValueError(f"interval_sec must be a non-negative number, got {interval_sec!r}")
+    # Sleep on the event loop instead of letting psutil block the worker.
+    t1 = psutil.cpu_times()
+    await asyncio.sleep(interval_sec)
+    t2 = psutil.cpu_times()
+    return {"cpu_usage_percent": round(_cpu_busy_percent(t1, t2), 2), "window_sec": interval_sec}
+
+
+def _scan_processes(limit: int) -> List[Dict[str, Any]]:
+    # Keep only the raw info and a flat array of CPU readings for the scan;
+    # output dicts (and the cmdline join) are built for the selected top-k.
+    infos: List[Dict[str, Any]] = []
+    cpus = array("d")
     for p in psutil.process_iter(attrs=["pid", "name", "cpu_percent", "memory_percent", "cmdline"]):
         info = p.info
-        procs.append(
+        infos.append(info)
+        cpus.append(float(info.get("cpu_percent") or 0.0))
+    top = heapq.nlargest(max(0, limit), range(len(cpus)), key=cpus.__getitem__)
+    result = []
+    for i in top:
+        info = infos[i]
+        result.append(
             {
                 "pid": info.get("pid"),
-                "cpu": round(float(info.get("cpu_percent") or 0.0), 2),
+                "cpu": round(cpus[i], 2),
                 "mem": round(float(info.get("memory_percent") or 0.0), 2),
                 "cmd": " ".join(info.get("cmdline") or [info.get("name") or "unknown"]),
             }
         )
-    procs.sort(key=lambda x: x["cpu"], reverse=True)
-    return procs[: max(0, limit)]
+    return result
 
 
-def store_in_file(file_name: str, content: str) -> Dict[str, Any]:
+# list_processes is served from a snapshot kept by one background thread.
+# The thread starts on the first request, takes its first snapshot
+# _PROC_FIRST_SAMPLE_SEC later and then rescans every
+# _PROC_SAMPLE_INTERVAL_SEC, keeping the top entries by CPU. It exits after
+# _PROC_IDLE_TIMEOUT_SEC without requests, so an unused server does no
+# scanning. Only the sampler calls process_iter: psutil reuses Process
+# objects across calls, so its cpu_percent readings are deltas since the
+# previous scan, and a second scanner would shorten that window.
+_PROC_FIRST_SAMPLE_SEC = 0.25
+_PROC_SAMPLE_INTERVAL_SEC = 1.0
+_PROC_IDLE_TIMEOUT_SEC = 30.0
+_PROC_WAIT_TIMEOUT_SEC = 5.0
+_PROC_MIN_CACHE_SIZE = 50
+_PROC_COND = threading.Condition()
+_PROC_SAMPLER: Optional[threading.Thread] = None
+_PROC_CACHE: Optional[Tuple[int, List[Dict[str, Any]]]] = None  # (size scanned for, top entries)
+_PROC_WANTED = _PROC_MIN_CACHE_SIZE
+_PROC_LAST_REQUEST = 0.0
+
+
+def _sample_processes() -> None:
+    global _PROC_SAMPLER, _PROC_CACHE, _PROC_WANTED
+    try:
+        _scan_processes(0)  # prime per-process cpu_percent baselines
+        delay = _PROC_FIRST_SAMPLE_SEC
+        while True:
+            time.sleep(delay)
+            delay = _PROC_SAMPLE_INTERVAL_SEC
+            with _PROC_COND:
+                if time.monotonic() - _PROC_LAST_REQUEST > _PROC_IDLE_TIMEOUT_SEC:
+                    return
+                size = _PROC_WANTED
+            try:
+                snapshot = _scan_processes(size)
+            except Exception:
+                logger.exception("Process sampling failed")
+                continue
+            with _PROC_COND:
+                _PROC_CACHE = (size, snapshot)
+                _PROC_COND.notify_all()
+    finally:
+        # However the thread ends, let the next request start a fresh one.
+        with _PROC_COND:
+            _PROC_SAMPLER = None
+            _PROC_CACHE = None
+            _PROC_WANTED = _PROC_MIN_CACHE_SIZE
+
+
+def list_processes(limit: int = 5) -> List[Dict[str, Any]]:
+    global _PROC_SAMPLER, _PROC_WANTED, _PROC_LAST_REQUEST
+    limit = max(0, limit)
+    deadline = time.monotonic() + _PROC_WAIT_TIMEOUT_SEC
+    with _PROC_COND:
+        _PROC_LAST_REQUEST = time.monotonic()
+        _PROC_WANTED = max(_PROC_WANTED, limit)
+        if _PROC_SAMPLER is None:
+            _PROC_SAMPLER = threading.Thread(target=_sample_processes, name="proc-sampler", daemon=True)
+            _PROC_SAMPLER.start()
+        # Wait for a snapshot that was scanned for at least `limit` entries;
+        # the first one arrives _PROC_FIRST_SAMPLE_SEC after the sampler starts.
+        while _PROC_CACHE is None or _PROC_CACHE[0] < limit:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise RuntimeError("Process snapshot not available; sampling is failing")
+            _PROC_COND.wait(remaining)
+        return _PROC_CACHE[1][:limit]
+
+
+_OUT_DIR = Path(__file__).resolve().parent.parent / "output"  # MCP/output
+_OUT_DIR.mkdir(parents=True, exist_ok=True)
+
+
+def _output_path(file_name: str) -> Path:
     if not file_name:
         raise ValueError("file_name is required")
-    base_dir = Path(__file__).resolve().parent.parent  # MCP/
-    out_dir = base_dir / "output"
-    out_dir.mkdir(parents=True, exist_ok=True)
-    dest = out_dir / file_name
-    dest.write_text(content, encoding="utf-8")
+    if file_name in (".", "..") or os.sep in file_name or (os.altsep and os.altsep in file_name):
+        raise ValueError(f"Invalid file_name: {file_name!r}")
+    return _OUT_DIR / file_name
+
+
+def _open_output(dest: Path) -> int:
+    return os.open(dest, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+
+
+def _write_all(fd: int, data: bytes) -> None:
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+
+
+def store_in_file(file_name: str, content: str) -> Dict[str, Any]:
+    dest = _output_path(file_name)
+    fd = _open_output(dest)
+    try:
+        _write_all(fd, content.encode("utf-8"))
+    finally:
+        os.close(fd)
     return {"path": str(dest)}
 
 
-TOOLS = {
-    "get_system_info": lambda args=None: get_system_info(),
-    "get_cpu_usage": lambda args=None: get_cpu_usage(
-        float((args or {}).get("interval_sec", 0.5))
-    ),
-    "list_processes": lambda args=None: list_processes(int((args or {}).get("limit", 5))),
-    "store_in_file": lambda args=None: store_in_file(
-        (args or {}).get("file_name"), (args or {}).get("content", "")
-    ),
+def _require_str(value: Any) -> str:
+    if not isinstance(value, str):
+        raise TypeError(f"expected a string, got {type(value).__name__}")
+    return value
+
+
+# name -> (function, ((arg name, converter, default), ...)). Converters are
+# applied only to supplied args; defaults are passed through as-is.
+TOOLS: Dict[str, Tuple[Callable[..., Any], Tuple[Tuple[str, Callable[[Any], Any], Any], ...]]] = {
+    "get_system_info": (get_system_info, ()),
+    "get_cpu_usage": (get_cpu_usage, (("interval_sec", float, 0.5),)),
+    "list_processes": (list_processes, (("limit", int, 5),)),
+    "store_in_file": (store_in_file, (("file_name", _require_str, None), ("content", _require_str, ""))),
 }
+_ASYNC_TOOLS = frozenset(name for name, (fn, _) in TOOLS.items() if inspect.iscoroutinefunction(fn))
+
+
+# The tool set is fixed at import, so the list/health bodies are encoded once.
+_TOOLS_LIST_JSON = orjson.dumps([{"name": name} for name in TOOLS.keys()])
+_HEALTH_JSON = orjson.dumps({"status": "ok", "tools": list(TOOLS.keys())})
 
 
 @app.get("/tools/list", response_model=List[ToolListItem])
-def tools_list():
-    return [ToolListItem(name=name) for name in TOOLS.keys()]
+async def tools_list():
+    return Response(content=_TOOLS_LIST_JSON, media_type="application/json")
+
+
+async def _invoke(name: str, args: Dict[str, Any]) -> Any:
+    fn, spec = TOOLS[name]
+    kwargs = {}
+    for k, conv, default in spec:
+        if k not in args:
+            kwargs[k] = default
+            continue
+        try:
+            kwargs[k] = conv(args[k])
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"Invalid '{k}': {e}")
+    if name in _ASYNC_TOOLS:
+        return await fn(**kwargs)
+    return await run_in_threadpool(fn, **kwargs)
 
 
-@app.post("/tools/call")
-def tools_call(body: ToolCall):
-    if body.name not in TOOLS:
-        raise HTTPException(status_code=404, detail=f"Unknown tool: {body.name}")
+# The body is parsed by hand to keep Pydantic off the hot path; ToolCall is
+# only used to describe the request in the OpenAPI schema.
+@app.post(
+    "/tools/call",
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {"application/json": {"schema": ToolCall.model_json_schema()}},
+        }
+    },
+)
+async def tools_call(request: Request):
     try:
-        result = TOOLS[body.name](body.args)
-        return {"result": result}
+        body = orjson.loads(await request.body())
+    except orjson.JSONDecodeError as e:
+        raise HTTPException(status_code=422, detail=f"Invalid JSON body: {e}")
+    if not isinstance(body, dict) or not isinstance(body.get("name"), str):
+        raise HTTPException(status_code=422, detail="Body must be an object with a string 'name'")
+    name = body["name"]
+    args = body.get("args") or {}
+    if not isinstance(args, dict):
+        raise HTTPException(status_code=422, detail="'args' must be an object")
+    if name not in TOOLS:
+        raise HTTPException(status_code=404, detail=f"Unknown tool: {name}")
+    try:
+        result = await _invoke(name, args)
+        return ORJSONResponse({"result": result})
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 
+async def _invoke_batch_item(item: Any) -> Dict[str, Any]:
+    if not isinstance(item, dict) or not isinstance(item.get("name"), str):
+        return {"error": "Item must be an object with a string 'name'"}
+    args = item.get("args") or {}
+    if not isinstance(args, dict):
+        return {"error": "'args' must be an object"}
+    if item["name"] not in TOOLS:
+        return {"error": f"Unknown tool: {item['name']}"}
+    try:
+        return {"result": await _invoke(item["name"], args)}
+    except Exception as e:
+        return {"error": str(e)}
+
+
+# Runs several independent tool calls in one round-trip. Items execute
+# concurrently and each gets its own {result} or {error} entry, in order.
+@app.post(
+    "/tools/batch",
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "application/json": {"schema": {"type": "array", "items": ToolCall.model_json_schema()}}
+            },
+        }
+    },
+)
+async def tools_batch(request: Request):
+    try:
+        body = orjson.loads(await request.body())
+    except orjson.JSONDecodeError as e:
+        raise HTTPException(status_code=422, detail=f"Invalid JSON body: {e}")
+    if not isinstance(body, list):
+        raise HTTPException(status_code=422, detail="Body must be an array of tool calls")
+    out = await asyncio.gather(*(_invoke_batch_item(item) for item in body))
+    return ORJSONResponse(out)
+
+
+def _open_temp_output(dest: Path) -> Tuple[int, str]:
+    fd, tmp = tempfile.mkstemp(dir=_OUT_DIR, prefix=f".{dest.name}.", suffix=".tmp")
+    os.chmod(tmp, 0o644)
+    return fd, tmp
+
+
+def _discard_temp(fd: int, tmp: str) -> None:
+    os.close(fd)
+    os.unlink(tmp)
+
+
+def _commit_temp(fd: int, tmp: str, dest: Path) -> None:
+    os.close(fd)
+    try:
+        os.replace(tmp, dest)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+# Streaming counterpart of store_in_file: the raw request body is written to
+# a temp file in the output dir chunk by chunk and only replaces the target
+# once the upload completes, so an aborted upload leaves the old file intact.
+@app.post("/tools/store_stream/{file_name}")
+async def tools_store_stream(file_name: str, request: Request):
+    try:
+        dest = _output_path(file_name)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    fd, tmp = await run_in_threadpool(_open_temp_output, dest)
+    try:
+        async for chunk in request.stream():
+            if chunk:
+                await run_in_threadpool(_write_all, fd, chunk)
+    except BaseException:
+        # Called inline: on cancellation an awaited cleanup could be skipped.
+        _discard_temp(fd, tmp)
+        raise
+    try:
+        await run_in_threadpool(_commit_temp, fd, tmp, dest)
+    except OSError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return ORJSONResponse({"path": str(dest)})
+
+
 @app.get("/health")
-def health():
-    return {"status": "ok", "tools": list(TOOLS.keys())}
+async def health():
+    return Response(content=_HEALTH_JSON, media_type="application/json")
+
+
+def run() -> None:
+    import uvicorn
+
+    # uvloop has no Windows build; fall back to the stock asyncio loop there.
+    uvicorn.run(
+        "app.main:app",
+        host=os.getenv("HOST", "127.0.0.1"),
+        port=int(os.getenv("PORT", "8000")),
+        loop="asyncio" if sys.platform == "win32" else "uvloop",
+        http="httptools",
+        # psutil baselines and the process snapshot are per-process state, so
+        # extra workers would answer from different samples; opt in via WORKERS.
+        workers=int(os.getenv("WORKERS", "1")),
+    )